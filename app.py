@@ -1,13 +1,114 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, g, has_request_context, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 import sqlite3
 import random
 import os
+import gzip
+import hmac
+import json
+import queue
+import select
+import sys
+import unicodedata
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Speedups listed in requirements.txt; the app still works with only the stdlib if one is missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+if orjson:
+    app.json = OrjsonProvider(app)
+# Keep Cyrillic as UTF-8 instead of \uXXXX escapes - roughly 3x fewer bytes per letter
+app.json.ensure_ascii = False
+
+# Responses smaller than this are not worth the compression CPU time
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+COMPRESSIBLE_MIMETYPES = {
+    "text/html", "text/css", "text/plain", "text/javascript",
+    "application/javascript", "application/json",
+}
+MSGPACK_MIMETYPE = "application/x-msgpack"
+MAX_BATCH_SIZE = 100
+
+# Live stats stream: keep-alive comment interval and how long one connection may stay open
+# before the browser is asked to reconnect, which frees the worker thread periodically
+SSE_HEARTBEAT = int(os.getenv('SSE_HEARTBEAT', 15))
+SSE_MAX_DURATION = int(os.getenv('SSE_MAX_DURATION', 300))
+# Every open stream holds one gthread thread, so cap them well below the thread count and
+# answer 503 above it; the page then falls back to polling
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', 8))
+COUNTS_INTERVAL = float(os.getenv('COUNTS_INTERVAL', 0.2))
+# On SQLite, how often (seconds) a process with open streams checks for commits made by other workers
+COUNTS_POLL_INTERVAL = float(os.getenv('COUNTS_POLL_INTERVAL', 1))
+DECK_CHANNEL = "deck_changes"
+
+# Request profiling is off unless PROFILE_DIR is set. Then a request is profiled when it sends
+# X-Profile: $PROFILE_TOKEN or is picked by PROFILE_SAMPLE_RATE (0.0 - 1.0). The same header is
+# required to read /profiles; without PROFILE_TOKEN only sampling works and the routes are off.
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.001))
+PROFILE_INDEX_SIZE = 50
+# Only the newest profiles are kept, older .json/.collapsed pairs are deleted as new ones are written
+PROFILE_RETENTION = int(os.getenv('PROFILE_RETENTION', 200))
+
+# How often (seconds) the background thread folds new review events into the rollups
+ROLLUP_INTERVAL = int(os.getenv('ROLLUP_INTERVAL', 60))
+# Monthly review_log partitions created in advance on PostgreSQL
+REVIEW_PARTITIONS_AHEAD = int(os.getenv('REVIEW_PARTITIONS_AHEAD', 2))
+
+# Background jobs: worker threads per process and rows handled per chunk (one transaction each)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_CHUNK_SIZE = int(os.getenv('JOB_CHUNK_SIZE', 1000))
+# Each process refreshes updated_at of its unfinished jobs every JOB_HEARTBEAT_INTERVAL seconds.
+# Unfinished jobs not refreshed for JOB_STALE_AFTER seconds belong to a dead process and are failed.
+JOB_HEARTBEAT_INTERVAL = int(os.getenv('JOB_HEARTBEAT_INTERVAL', 30))
+JOB_STALE_AFTER = int(os.getenv('JOB_STALE_AFTER', 300))
+JOB_INTERRUPTED_ERROR = "Задача прервана: процесс, выполнявший её, остановлен"
+
+# Local SQLite tuning. All writes of a process go through one writer thread which commits
+# up to WRITE_BATCH_SIZE queued operations in a single transaction.
+SQLITE_PATH = os.getenv('SQLITE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), "flashcards.db")
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 30))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_STATEMENT_CACHE = 256
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 64))
 
 # Check if we're running on Render (PostgreSQL) or locally (SQLite)
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -21,19 +122,209 @@ def connect_db():
     if DATABASE_URL:  # We're on Render
         try:
             conn = psycopg2.connect(DATABASE_URL, cursor_factory=DictCursor)
-            return conn
+            return profiled_connection(conn)
         except Exception as e:
             print("Ошибка подключения к PostgreSQL: {}".format(e))
             raise
     else:  # We're running locally
         try:
-            db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "flashcards.db")
-            print("Используем локальную базу данных SQLite: {}".format(db_path))
-            return sqlite3.connect(db_path)
+            return profiled_connection(sqlite_readers.get())
         except sqlite3.Error as e:
             print("Ошибка подключения к SQLite: {}".format(e))
             raise
 
+def connect_sqlite(**kwargs):
+    conn = sqlite3.connect(SQLITE_PATH, timeout=SQLITE_BUSY_TIMEOUT,
+                           cached_statements=SQLITE_STATEMENT_CACHE, **kwargs)
+    # WAL itself is persistent and enabled once in init_db, these are per connection
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA mmap_size = {}".format(SQLITE_MMAP_SIZE))
+    return conn
+
+class ReaderConnection(sqlite3.Connection):
+    # Plain subclass only so reader connections can be tracked by weak reference
+    pass
+
+class SQLiteReaders:
+    # One connection per thread, reused by every request the thread serves, so the statement
+    # cache and the per-connection PRAGMAs are paid once. A connection goes away with its thread.
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = weakref.WeakSet()
+        self._generation = 0
+
+    def get(self):
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            print("Используем локальную базу данных SQLite: {}".format(SQLITE_PATH))
+            conn = connect_sqlite(factory=ReaderConnection, check_same_thread=False)
+            with self._lock:
+                self._connections.add(conn)
+                local.conn, local.generation = conn, self._generation
+        return local.conn
+
+    def close(self):
+        # Closes the connections of all threads; each thread opens a new one on its next request
+        with self._lock:
+            connections = list(self._connections)
+            self._connections = weakref.WeakSet()
+            self._generation += 1
+        for conn in connections:
+            conn.close()
+
+sqlite_readers = SQLiteReaders()
+
+class SQLiteWriter:
+    # Single writer thread per process. Queued operations run one after another, each in its own
+    # savepoint so a failing one does not affect the rest, and the whole batch is committed at once.
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._conn = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, operation, timings=None):
+        self._start()
+        future = Future()
+        self._queue.put((operation, timings, future))
+        return future
+
+    def close(self):
+        # Closes the writer's connection (from its own thread); the next write reopens it
+        if self._thread is not None:
+            self.submit(None).result()
+
+    def _start(self):
+        # Started lazily so every gunicorn worker gets its own thread after the fork
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        results = []
+        try:
+            if self._conn is None:
+                self._conn = connect_sqlite(isolation_level=None)
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            for operation, timings, future in batch:
+                if operation is None:
+                    results.append((future, None, None))
+                    continue
+                cursor.execute("SAVEPOINT write_operation")
+                try:
+                    operation_cursor = self._conn.cursor()
+                    if timings is not None:
+                        operation_cursor = TimedCursor(operation_cursor, timings)
+                    results.append((future, operation(operation_cursor), None))
+                    cursor.execute("RELEASE write_operation")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO write_operation")
+                    cursor.execute("RELEASE write_operation")
+                    results.append((future, None, e))
+            cursor.execute("COMMIT")
+        except Exception as e:
+            if self._conn is not None and self._conn.in_transaction:
+                self._conn.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        if any(operation is None for operation, _, _ in batch):
+            self._conn.close()
+            self._conn = None
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+sqlite_writer = SQLiteWriter(WRITE_BATCH_SIZE)
+
+def close_db():
+    # Local SQLite only: releases every connection of this process, e.g. before the file is removed
+    sqlite_readers.close()
+    sqlite_writer.close()
+
+def run_write(operation):
+    # Runs operation(cursor) in a write transaction and returns its result once committed
+    if DATABASE_URL:
+        with connect_db() as conn:
+            result = operation(conn.cursor())
+            conn.commit()
+            return result
+
+    timings = None
+    if PROFILE_DIR and has_request_context() and g.get("profile"):
+        timings = g.profile.sql
+    return sqlite_writer.submit(operation, timings).result()
+
+class TimedCursor:
+    # Records how long every statement takes while a request is being profiled
+    def __init__(self, cursor, timings):
+        self._cursor = cursor
+        self._timings = timings
+
+    def _timed(self, method, sql, *args):
+        start = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            self._timings.append({
+                "statement": " ".join(sql.split()),
+                "ms": round((time.perf_counter() - start) * 1000, 3),
+            })
+
+    def execute(self, sql, *args):
+        return self._timed(self._cursor.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(self._cursor.executemany, sql, *args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class TimedConnection:
+    def __init__(self, conn, timings):
+        self._conn = conn
+        self._timings = timings
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs), self._timings)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def profiled_connection(conn):
+    if PROFILE_DIR and has_request_context() and g.get("profile"):
+        return TimedConnection(conn, g.profile.sql)
+    return conn
+
 def init_db():
     with connect_db() as conn:
         cursor = conn.cursor()
@@ -53,6 +344,7 @@ def init_db():
                     CREATE TABLE words (
                         id SERIAL PRIMARY KEY,
                         word TEXT NOT NULL,
+                        word_key TEXT,
                         translation TEXT NOT NULL,
                         progress INTEGER DEFAULT 0
                     )
@@ -64,9 +356,11 @@ def init_db():
                     ("world", "мир"),
                     ("book", "книга")
                 ]
-                cursor.executemany("INSERT INTO words (word, translation, progress) VALUES (%s, %s, 0)", test_words)
+                cursor.executemany("INSERT INTO words (word, word_key, translation, progress) VALUES (%s, %s, %s, 0)",
+                                   [(w, normalize_word(w), t) for w, t in test_words])
                 
         else:  # SQLite
+            cursor.execute("PRAGMA journal_mode = WAL")
             cursor.execute("""
                 SELECT name FROM sqlite_master 
                 WHERE type='table' AND name='words'
@@ -78,6 +372,7 @@ def init_db():
                     CREATE TABLE IF NOT EXISTS words (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         word TEXT NOT NULL,
+                        word_key TEXT,
                         translation TEXT NOT NULL,
                         progress INTEGER DEFAULT 0
                     )
@@ -88,12 +383,738 @@ def init_db():
                     ("world", "мир"),
                     ("book", "книга")
                 ]
-                cursor.executemany("INSERT INTO words (word, translation, progress) VALUES (?, ?, 0)", test_words)
-        
+                cursor.executemany("INSERT INTO words (word, word_key, translation, progress) VALUES (?, ?, ?, 0)",
+                                   [(w, normalize_word(w), t) for w, t in test_words])
+
+        init_word_keys(cursor)
+        init_review_tables(cursor)
+        init_job_table(cursor)
         conn.commit()
 
+    ensure_review_partitions()
+
+def normalize_word(word):
+    # "Hello", " hello " and NFD-composed Cyrillic all map to the same lookup key
+    word = " ".join(word.split())
+    return unicodedata.normalize("NFC", word.casefold())
+
+def init_word_keys(cursor):
+    # Databases created before word_key existed get the column added and backfilled
+    if DATABASE_URL:
+        cursor.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'words' AND column_name = 'word_key'
+        """)
+        has_key = cursor.fetchone() is not None
+    else:
+        cursor.execute("PRAGMA table_info(words)")
+        has_key = any(row[1] == "word_key" for row in cursor.fetchall())
+
+    if not has_key:
+        cursor.execute("ALTER TABLE words ADD COLUMN word_key TEXT")
+
+    cursor.execute("SELECT id, word FROM words WHERE word_key IS NULL")
+    missing = [(normalize_word(row[1]), row[0]) for row in cursor.fetchall()]
+    if missing:
+        if DATABASE_URL:
+            cursor.executemany("UPDATE words SET word_key = %s WHERE id = %s", missing)
+        else:
+            cursor.executemany("UPDATE words SET word_key = ? WHERE id = ?", missing)
+
+    cursor.execute("""
+        SELECT COUNT(*) FROM (
+            SELECT word_key FROM words GROUP BY word_key HAVING COUNT(*) > 1
+        ) AS duplicates
+    """)
+    if cursor.fetchone()[0]:
+        print("В базе есть дубликаты слов, выполните 'flask dedupe-words' для их объединения")
+        return
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS words_word_key_idx ON words (word_key)")
+
+def dedupe_words(cursor):
+    # Keep the oldest row of every duplicate group with the best progress of the group
+    cursor.execute("""
+        SELECT word_key, MIN(id), MAX(progress) FROM words
+        GROUP BY word_key HAVING COUNT(*) > 1
+    """)
+    groups = cursor.fetchall()
+    removed = 0
+    for word_key, keep_id, progress in groups:
+        if DATABASE_URL:
+            cursor.execute("UPDATE words SET progress = %s WHERE id = %s", (progress, keep_id))
+            cursor.execute("DELETE FROM words WHERE word_key = %s AND id <> %s", (word_key, keep_id))
+        else:
+            cursor.execute("UPDATE words SET progress = ? WHERE id = ?", (progress, keep_id))
+            cursor.execute("DELETE FROM words WHERE word_key = ? AND id <> ?", (word_key, keep_id))
+        removed += cursor.rowcount
+    return removed
+
+@app.cli.command("dedupe-words")
+def dedupe_words_command():
+    """Backfill word keys and merge duplicate words."""
+    with connect_db() as conn:
+        cursor = conn.cursor()
+        init_word_keys(cursor)
+        removed = dedupe_words(cursor)
+        init_word_keys(cursor)
+        conn.commit()
+    print("Удалено дубликатов: {}".format(removed))
+
+def init_review_tables(cursor):
+    # Append-only review log plus the rollups that analytics endpoints read from
+    if DATABASE_URL:  # PostgreSQL
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_log (
+                id BIGSERIAL,
+                word TEXT NOT NULL,
+                known SMALLINT NOT NULL,
+                day DATE NOT NULL,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW()
+            ) PARTITION BY RANGE (day)
+        ''')
+        cursor.execute("CREATE TABLE IF NOT EXISTS review_log_default PARTITION OF review_log DEFAULT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS review_log_day_idx ON review_log (day)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_daily (
+                day DATE PRIMARY KEY,
+                reviews INTEGER NOT NULL,
+                known INTEGER NOT NULL,
+                unknown INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_word_daily (
+                day DATE NOT NULL,
+                word TEXT NOT NULL,
+                reviews INTEGER NOT NULL,
+                unknown INTEGER NOT NULL,
+                PRIMARY KEY (day, word)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_rollup_state (
+                id INTEGER PRIMARY KEY,
+                last_day DATE
+            )
+        ''')
+        cursor.execute("INSERT INTO review_rollup_state (id, last_day) VALUES (1, NULL) ON CONFLICT (id) DO NOTHING")
+    else:  # SQLite
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                word TEXT NOT NULL,
+                known INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS review_log_day_idx ON review_log (day)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_daily (
+                day TEXT PRIMARY KEY,
+                reviews INTEGER NOT NULL,
+                known INTEGER NOT NULL,
+                unknown INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_word_daily (
+                day TEXT NOT NULL,
+                word TEXT NOT NULL,
+                reviews INTEGER NOT NULL,
+                unknown INTEGER NOT NULL,
+                PRIMARY KEY (day, word)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS review_rollup_state (
+                id INTEGER PRIMARY KEY,
+                last_day TEXT
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO review_rollup_state (id, last_day) VALUES (1, NULL)")
+
+def init_job_table(cursor):
+    if DATABASE_URL:  # PostgreSQL
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id SERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                cancel_requested SMALLINT NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        ''')
+    else:  # SQLite
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 0,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                owner TEXT,
+                created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    fail_stale_jobs(cursor)
+
+def fail_stale_jobs(cursor):
+    if DATABASE_URL:
+        cursor.execute("""
+            UPDATE jobs SET status = 'failed', error = %s, updated_at = NOW()
+            WHERE status IN ('queued', 'running') AND updated_at < NOW() - %s * INTERVAL '1 second'
+        """, (JOB_INTERRUPTED_ERROR, JOB_STALE_AFTER))
+    else:
+        cursor.execute("""
+            UPDATE jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running') AND updated_at < datetime('now', ?)
+        """, (JOB_INTERRUPTED_ERROR, "-{} seconds".format(JOB_STALE_AFTER)))
+
+def month_start(day, months_ahead=0):
+    month = day.month - 1 + months_ahead
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1, day=1)
+
+def ensure_review_partitions():
+    # PostgreSQL only: keeps monthly partitions of review_log ready for this and the next
+    # REVIEW_PARTITIONS_AHEAD months, so events never land in the default partition and
+    # old months can be detached or dropped as a whole
+    if not DATABASE_URL:
+        return
+    current = datetime.now(timezone.utc).date()
+    with connect_db() as conn:
+        cursor = conn.cursor()
+        for months_ahead in range(REVIEW_PARTITIONS_AHEAD + 1):
+            start = month_start(current, months_ahead)
+            end = month_start(current, months_ahead + 1)
+            try:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS review_log_{} PARTITION OF review_log
+                    FOR VALUES FROM ('{}') TO ('{}')
+                """.format(start.strftime("%Y_%m"), start.isoformat(), end.isoformat()))
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                print("Не удалось создать раздел журнала повторений за {}: {}".format(start.strftime("%Y-%m"), e))
+
 init_db()
 
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    # Handle passed to job functions for progress reporting and cancellation checks
+    def __init__(self, job_id):
+        self.id = job_id
+
+    def set_status(self, status, error=None):
+        def write(cursor):
+            if DATABASE_URL:
+                cursor.execute("UPDATE jobs SET status = %s, error = %s, updated_at = NOW() WHERE id = %s",
+                               (status, error, self.id))
+            else:
+                cursor.execute("UPDATE jobs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                               (status, error, self.id))
+
+        run_write(write)
+
+    def report(self, done, total):
+        # Also the cancellation point: raises JobCancelled if cancel was requested meanwhile
+        def write(cursor):
+            if DATABASE_URL:
+                cursor.execute("""
+                    UPDATE jobs SET done = %s, total = %s, updated_at = NOW() WHERE id = %s
+                    RETURNING cancel_requested
+                """, (done, total, self.id))
+            else:
+                cursor.execute("UPDATE jobs SET done = ?, total = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                               (done, total, self.id))
+                cursor.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,))
+            return cursor.fetchone()[0]
+
+        if run_write(write):
+            raise JobCancelled()
+
+def reset_progress_job(job):
+    with connect_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM words")
+        total, max_id = cursor.fetchone()
+
+    job.report(0, total)
+    done = 0
+    last_id = 0
+    def reset_chunk(cursor):
+        if DATABASE_URL:
+            cursor.execute("SELECT COUNT(*), MAX(id) FROM (SELECT id FROM words WHERE id > %s ORDER BY id LIMIT %s) AS chunk",
+                           (last_id, JOB_CHUNK_SIZE))
+        else:
+            cursor.execute("SELECT COUNT(*), MAX(id) FROM (SELECT id FROM words WHERE id > ? ORDER BY id LIMIT ?)",
+                           (last_id, JOB_CHUNK_SIZE))
+        count, chunk_end = cursor.fetchone()
+        if not count:
+            return 0, None
+        if DATABASE_URL:
+            cursor.execute("UPDATE words SET progress = 0 WHERE id > %s AND id <= %s AND progress <> 0",
+                           (last_id, chunk_end))
+        else:
+            cursor.execute("UPDATE words SET progress = 0 WHERE id > ? AND id <= ? AND progress <> 0",
+                           (last_id, chunk_end))
+        return count, chunk_end
+
+    while last_id < max_id:
+        count, chunk_end = run_write(reset_chunk)
+        if not count:
+            break
+        done += count
+        last_id = chunk_end
+        job.report(done, total)
+
+    run_write(lambda cursor: notify_change(cursor, "reset"))
+    publish_change("reset")
+
+JOB_KINDS = {
+    "reset_progress": reset_progress_job,
+}
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+def run_job(job_id, kind):
+    job = Job(job_id)
+    def start(cursor):
+        if DATABASE_URL:
+            cursor.execute("UPDATE jobs SET status = 'running', updated_at = NOW() WHERE id = %s AND cancel_requested = 0", (job_id,))
+        else:
+            cursor.execute("UPDATE jobs SET status = 'running', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND cancel_requested = 0", (job_id,))
+        return cursor.rowcount
+
+    try:
+        if run_write(start) == 0:
+            raise JobCancelled()
+        JOB_KINDS[kind](job)
+        finish_job(job, "done")
+    except JobCancelled:
+        finish_job(job, "cancelled")
+    except Exception as e:
+        print("Ошибка выполнения задачи {}: {}".format(job_id, e))
+        finish_job(job, "failed", str(e))
+
+def finish_job(job, status, error=None):
+    # Runs inside the executor, where an exception would be silently kept in the future
+    try:
+        job.set_status(status, error)
+    except Exception as e:
+        print("Не удалось сохранить статус '{}' задачи {}: {}".format(status, job.id, e))
+
+_job_owner = None
+
+def job_owner():
+    # Unique per process, also across a restart that reuses the same pid
+    global _job_owner
+    if _job_owner is None or _job_owner[0] != os.getpid():
+        _job_owner = (os.getpid(), "{}-{}".format(os.getpid(), uuid.uuid4().hex[:8]))
+    return _job_owner[1]
+
+def job_heartbeat():
+    owner = job_owner()
+
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("UPDATE jobs SET updated_at = NOW() WHERE owner = %s AND status IN ('queued', 'running')", (owner,))
+        else:
+            cursor.execute("UPDATE jobs SET updated_at = CURRENT_TIMESTAMP WHERE owner = ? AND status IN ('queued', 'running')", (owner,))
+        fail_stale_jobs(cursor)
+
+    run_write(write)
+
+_job_heartbeat = None
+_job_heartbeat_lock = threading.Lock()
+
+def job_heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        try:
+            job_heartbeat()
+        except Exception as e:
+            print("Ошибка обновления задач: {}".format(e))
+
+@app.before_request
+def start_job_heartbeat():
+    # Started on the first request in every worker, not only the ones that ran a job, so jobs
+    # orphaned by a dead process are failed by whichever workers are still alive
+    global _job_heartbeat
+    if _job_heartbeat is not None:
+        return
+    with _job_heartbeat_lock:
+        if _job_heartbeat is None:
+            _job_heartbeat = threading.Thread(target=job_heartbeat_loop, daemon=True)
+            _job_heartbeat.start()
+
+def submit_job(kind):
+    owner = job_owner()
+
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("INSERT INTO jobs (kind, owner) VALUES (%s, %s) RETURNING id", (kind, owner))
+            return cursor.fetchone()[0]
+        cursor.execute("INSERT INTO jobs (kind, owner) VALUES (?, ?)", (kind, owner))
+        return cursor.lastrowid
+
+    job_id = run_write(write)
+    start_job_heartbeat()
+    job_executor.submit(run_job, job_id, kind)
+    return job_id
+
+def make_payload(data):
+    # Bulk card payloads can be sent as MessagePack when the client asks for it
+    if msgpack and request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE:
+        response = Response(msgpack.packb(data, use_bin_type=True), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(data)
+    if msgpack:
+        response.vary.add("Accept")
+    return response
+
+def today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+def log_review(cursor, word, known):
+    # Called inside the route's transaction, so the event commits together with the progress change.
+    # Logs the stored spelling of the word, so input variants of one word share their rollup rows.
+    if DATABASE_URL:
+        cursor.execute("INSERT INTO review_log (word, known, day) SELECT word, %s, %s FROM words WHERE word_key = %s",
+                       (int(known), today(), normalize_word(word)))
+    else:
+        cursor.execute("INSERT INTO review_log (word, known, day) SELECT word, ?, ? FROM words WHERE word_key = ?",
+                       (int(known), today(), normalize_word(word)))
+
+def rollup_reviews():
+    # Recompute the rollups for the still-open days only. Earlier days are final,
+    # so a run touches at most today's and yesterday's events no matter how big the log is.
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("SELECT last_day FROM review_rollup_state WHERE id = 1 FOR UPDATE")
+        else:
+            cursor.execute("SELECT last_day FROM review_rollup_state WHERE id = 1")
+        last_day = cursor.fetchone()[0]
+
+        if last_day:
+            since = (datetime.fromisoformat(str(last_day)).date() - timedelta(days=1)).isoformat()
+        else:
+            since = "0001-01-01"
+
+        if DATABASE_URL:
+            cursor.execute("SELECT MAX(day) FROM review_log WHERE day >= %s", (since,))
+        else:
+            cursor.execute("SELECT MAX(day) FROM review_log WHERE day >= ?", (since,))
+        max_day = cursor.fetchone()[0]
+        if max_day is None:
+            return
+
+        if DATABASE_URL:
+            cursor.execute("DELETE FROM review_daily WHERE day >= %s", (since,))
+            cursor.execute("""
+                INSERT INTO review_daily (day, reviews, known, unknown)
+                SELECT day, COUNT(*), SUM(known), COUNT(*) - SUM(known)
+                FROM review_log WHERE day >= %s GROUP BY day
+            """, (since,))
+            cursor.execute("DELETE FROM review_word_daily WHERE day >= %s", (since,))
+            cursor.execute("""
+                INSERT INTO review_word_daily (day, word, reviews, unknown)
+                SELECT day, word, COUNT(*), COUNT(*) - SUM(known)
+                FROM review_log WHERE day >= %s GROUP BY day, word
+            """, (since,))
+            cursor.execute("UPDATE review_rollup_state SET last_day = %s WHERE id = 1", (max_day,))
+        else:
+            cursor.execute("DELETE FROM review_daily WHERE day >= ?", (since,))
+            cursor.execute("""
+                INSERT INTO review_daily (day, reviews, known, unknown)
+                SELECT day, COUNT(*), SUM(known), COUNT(*) - SUM(known)
+                FROM review_log WHERE day >= ? GROUP BY day
+            """, (since,))
+            cursor.execute("DELETE FROM review_word_daily WHERE day >= ?", (since,))
+            cursor.execute("""
+                INSERT INTO review_word_daily (day, word, reviews, unknown)
+                SELECT day, word, COUNT(*), COUNT(*) - SUM(known)
+                FROM review_log WHERE day >= ? GROUP BY day, word
+            """, (since,))
+            cursor.execute("UPDATE review_rollup_state SET last_day = ? WHERE id = 1", (max_day,))
+
+    run_write(write)
+
+_rollup_worker = None
+_rollup_worker_lock = threading.Lock()
+
+def rollup_worker_loop():
+    while True:
+        time.sleep(ROLLUP_INTERVAL)
+        try:
+            ensure_review_partitions()
+            rollup_reviews()
+        except Exception as e:
+            print("Ошибка обновления статистики повторений: {}".format(e))
+
+@app.before_request
+def start_rollup_worker():
+    # Started on the first request so every gunicorn worker gets its own thread after the fork
+    global _rollup_worker
+    if ROLLUP_INTERVAL <= 0 or _rollup_worker is not None:
+        return
+    with _rollup_worker_lock:
+        if _rollup_worker is None:
+            _rollup_worker = threading.Thread(target=rollup_worker_loop, daemon=True)
+            _rollup_worker.start()
+
+class ChangeBroadcaster:
+    # Fans deck change messages out to every /events connection of this process
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        # Returns None when the process already serves max_subscribers streams
+        subscriber = queue.Queue(maxsize=100)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def has_subscribers(self):
+        return bool(self._subscribers)
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                # A stalled client only misses intermediate counters, the next message is complete
+                pass
+
+changes = ChangeBroadcaster(SSE_MAX_STREAMS)
+
+def read_counts(cursor):
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(CASE WHEN progress = 5 THEN 1 ELSE 0 END), 0) FROM words")
+    total_count, learned_count = cursor.fetchone()
+    return {"total_words": total_count, "learned_words": learned_count}
+
+class CountsPublisher:
+    # Recounts the deck after a change and pushes the counters to local streams. Runs on its own
+    # thread with its own connection, outside any write transaction, only while someone listens,
+    # and a burst of changes is coalesced into one count per COUNTS_INTERVAL. On SQLite it also
+    # polls PRAGMA data_version, which changes when another connection commits, so writes made
+    # by other gunicorn workers reach this process's streams too.
+    def __init__(self, interval):
+        self.interval = interval
+        self._event = None
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def request(self, event):
+        if not changes.has_subscribers():
+            return
+        self._event = event
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deck-counts", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        seen_version = None
+        while True:
+            woken = self._wake.wait(None if DATABASE_URL else COUNTS_POLL_INTERVAL)
+            self._wake.clear()
+            if not changes.has_subscribers():
+                continue
+            try:
+                with connect_db() as conn:
+                    cursor = conn.cursor()
+                    if not DATABASE_URL:
+                        # data_version is per connection, so remember which connection it came from
+                        cursor.execute("PRAGMA data_version")
+                        version = (id(conn), cursor.fetchone()[0])
+                        if not woken and version == seen_version:
+                            continue
+                        seen_version = version
+                    message = dict(read_counts(cursor), event=self._event if woken else "changed")
+                changes.publish(message)
+            except Exception as e:
+                print("Ошибка подсчёта слов: {}".format(e))
+            time.sleep(self.interval)
+
+counts_publisher = CountsPublisher(COUNTS_INTERVAL)
+
+def notify_change(cursor, event):
+    # Called inside the write transaction. On PostgreSQL the NOTIFY reaches the listener of
+    # every worker, and only if the transaction commits.
+    if DATABASE_URL:
+        cursor.execute("SELECT pg_notify(%s, %s)", (DECK_CHANNEL, event))
+
+def publish_change(event):
+    # Called after commit. On SQLite this updates the streams of this process right away, the
+    # other workers pick the commit up through data_version polling within COUNTS_POLL_INTERVAL.
+    if not DATABASE_URL:
+        counts_publisher.request(event)
+
+_change_listener = None
+_change_listener_lock = threading.Lock()
+
+def change_listener_loop():
+    while True:
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.autocommit = True
+            conn.cursor().execute("LISTEN {}".format(DECK_CHANNEL))
+            while True:
+                if select.select([conn], [], [], SSE_HEARTBEAT) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    counts_publisher.request(conn.notifies.pop(0).payload)
+        except Exception as e:
+            print("Ошибка подписки на изменения: {}".format(e))
+            time.sleep(5)
+
+def start_change_listener():
+    # Only PostgreSQL needs a listener, it relays NOTIFY from all workers to local clients
+    global _change_listener
+    if not DATABASE_URL or _change_listener is not None:
+        return
+    with _change_listener_lock:
+        if _change_listener is None:
+            _change_listener = threading.Thread(target=change_listener_loop, daemon=True)
+            _change_listener.start()
+
+def format_event(message):
+    return "event: deck\ndata: {}\n\n".format(json.dumps(message, ensure_ascii=False))
+
+class StackSampler:
+    # Samples the call stack of one thread and counts identical stacks (collapsed stack format)
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.sql = []
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return (time.perf_counter() - self.started) * 1000
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+def profile_authorized():
+    return bool(PROFILE_TOKEN) and hmac.compare_digest(request.headers.get("X-Profile", ""), PROFILE_TOKEN)
+
+def write_profile_file(path, write):
+    # Written under a temporary name and renamed, so other workers never read a partial file
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        write(f)
+    os.replace(path + ".tmp", path)
+
+def prune_profiles():
+    # Names start with a timestamp, so sorting them puts the oldest profiles first
+    names = sorted(set(os.path.splitext(f)[0] for f in os.listdir(PROFILE_DIR)
+                       if f.endswith((".json", ".collapsed"))))
+    for name in names[:max(0, len(names) - PROFILE_RETENTION)]:
+        for ext in (".json", ".collapsed"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name + ext))
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+
+@app.before_request
+def start_profile():
+    if not PROFILE_DIR or request.endpoint in ("list_profiles", "get_profile"):
+        return
+    if not profile_authorized() and random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    g.profile = StackSampler(threading.get_ident(), PROFILE_INTERVAL)
+    g.profile.start()
+
+@app.teardown_request
+def finish_profile(exc):
+    if not PROFILE_DIR:
+        return
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+    duration_ms = profile.stop()
+
+    name = "{}-{}-{}".format(
+        datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f"),
+        request.method,
+        (request.endpoint or "unknown").replace(".", "_"),
+    )
+    meta = {
+        "name": name,
+        "method": request.method,
+        "path": request.path,
+        "duration_ms": round(duration_ms, 3),
+        "samples": sum(profile.stacks.values()),
+        "sql_ms": round(sum(item["ms"] for item in profile.sql), 3),
+        "sql": profile.sql,
+        "error": repr(exc) if exc else None,
+    }
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        write_profile_file(os.path.join(PROFILE_DIR, name + ".collapsed"), lambda f: f.writelines(
+            "{} {}\n".format(stack, count) for stack, count in sorted(profile.stacks.items())
+        ))
+        write_profile_file(os.path.join(PROFILE_DIR, name + ".json"),
+                           lambda f: json.dump(meta, f, ensure_ascii=False, indent=2))
+        prune_profiles()
+    except OSError as e:
+        print("Ошибка записи профиля: {}".format(e))
+
+def choose_encoding():
+    accepted = request.accept_encodings
+    if brotli and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -119,25 +1140,48 @@ def get_random_word():
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
+@app.route("/words", methods=["GET"])
+def get_random_words():
+    limit = request.args.get("limit", 10, type=int)
+    limit = max(1, min(limit, MAX_BATCH_SIZE))
+
+    try:
+        with connect_db() as conn:
+            cursor = conn.cursor()
+            if DATABASE_URL:
+                cursor.execute("SELECT word, translation FROM words WHERE progress < 5 ORDER BY RANDOM() LIMIT %s", (limit,))
+            else:
+                cursor.execute("SELECT word, translation FROM words WHERE progress < 5 ORDER BY RANDOM() LIMIT ?", (limit,))
+
+            words = [{"word": row[0], "translation": row[1]} for row in cursor.fetchall()]
+            return make_payload({"words": words})
+    except (sqlite3.Error, psycopg2.Error) as e:
+        return jsonify({"error": "Ошибка базы данных"}), 500
+
 @app.route("/mark_known", methods=["POST"])
 def mark_known():
     data = request.json
     word = data.get("word")
 
-    if not word:
+    if not isinstance(word, str) or not word.strip():
         return jsonify({"error": "Не указано слово"}), 400
 
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("UPDATE words SET progress = 5 WHERE word_key = %s", (normalize_word(word),))
+        else:
+            cursor.execute("UPDATE words SET progress = 5 WHERE word_key = ?", (normalize_word(word),))
+        if cursor.rowcount == 0:
+            return None
+        log_review(cursor, word, known=True)
+        notify_change(cursor, "progress")
+        return True
+
     try:
-        with connect_db() as conn:
-            cursor = conn.cursor()
-            if DATABASE_URL:
-                cursor.execute("UPDATE words SET progress = 5 WHERE word = %s", (word,))
-            else:
-                cursor.execute("UPDATE words SET progress = 5 WHERE word = ?", (word,))
-            conn.commit()
-            if cursor.rowcount == 0:
-                return jsonify({"error": "Слово не найдено"}), 404
-            return jsonify({"success": True, "message": "Слово '{}' отмечено как изученное!".format(word)})
+        if not run_write(write):
+            return jsonify({"error": "Слово не найдено"}), 404
+        publish_change("progress")
+        return jsonify({"success": True, "message": "Слово '{}' отмечено как изученное!".format(word)})
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
@@ -146,20 +1190,25 @@ def increase_progress():
     data = request.json
     word = data.get("word")
 
-    if not word:
+    if not isinstance(word, str) or not word.strip():
         return jsonify({"error": "Не указано слово"}), 400
 
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("UPDATE words SET progress = progress + 1 WHERE word_key = %s AND progress < 5", (normalize_word(word),))
+        else:
+            cursor.execute("UPDATE words SET progress = progress + 1 WHERE word_key = ? AND progress < 5", (normalize_word(word),))
+        if cursor.rowcount == 0:
+            return None
+        log_review(cursor, word, known=False)
+        notify_change(cursor, "progress")
+        return True
+
     try:
-        with connect_db() as conn:
-            cursor = conn.cursor()
-            if DATABASE_URL:
-                cursor.execute("UPDATE words SET progress = progress + 1 WHERE word = %s AND progress < 5", (word,))
-            else:
-                cursor.execute("UPDATE words SET progress = progress + 1 WHERE word = ? AND progress < 5", (word,))
-            conn.commit()
-            if cursor.rowcount == 0:
-                return jsonify({"error": "Слово не найдено или уже изучено"}), 404
-            return jsonify({"success": True})
+        if not run_write(write):
+            return jsonify({"error": "Слово не найдено или уже изучено"}), 404
+        publish_change("progress")
+        return jsonify({"success": True})
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
@@ -169,33 +1218,37 @@ def add_word():
     word = data.get("word")
     translation = data.get("translation")
 
-    if not word or not translation:
+    if not isinstance(word, str) or not isinstance(translation, str) or not word.strip() or not translation:
         return jsonify({"error": "Пожалуйста, укажите слово и перевод"}), 400
+    word = word.strip()
 
-    try:
-        with connect_db() as conn:
-            cursor = conn.cursor()
+    def write(cursor):
+        # Check if word exists
+        if DATABASE_URL:
+            cursor.execute("SELECT * FROM words WHERE word_key = %s", (normalize_word(word),))
+        else:
+            cursor.execute("SELECT * FROM words WHERE word_key = ?", (normalize_word(word),))
+        
+        existing_word = cursor.fetchone()
+        if existing_word:
+            return None
 
-            # Check if word exists
-            if DATABASE_URL:
-                cursor.execute("SELECT * FROM words WHERE word = %s", (word,))
-            else:
-                cursor.execute("SELECT * FROM words WHERE word = ?", (word,))
-            
-            existing_word = cursor.fetchone()
-            if existing_word:
-                return jsonify({"error": "Слово '{}' уже существует!".format(word)}), 409
+        # Add the word
+        if DATABASE_URL:
+            cursor.execute("INSERT INTO words (word, word_key, translation, progress) VALUES (%s, %s, %s, 0)", 
+                         (word, normalize_word(word), translation))
+        else:
+            cursor.execute("INSERT INTO words (word, word_key, translation, progress) VALUES (?, ?, ?, 0)", 
+                         (word, normalize_word(word), translation))
+        
+        notify_change(cursor, "added")
+        return True
 
-            # Add the word
-            if DATABASE_URL:
-                cursor.execute("INSERT INTO words (word, translation, progress) VALUES (%s, %s, 0)", 
-                             (word, translation))
-            else:
-                cursor.execute("INSERT INTO words (word, translation, progress) VALUES (?, ?, 0)", 
-                             (word, translation))
-            
-            conn.commit()
-            return jsonify({"success": True, "message": "Слово добавлено!"})
+    try:
+        if not run_write(write):
+            return jsonify({"error": "Слово '{}' уже существует!".format(word)}), 409
+        publish_change("added")
+        return jsonify({"success": True, "message": "Слово добавлено!"})
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
@@ -204,31 +1257,88 @@ def delete_word():
     data = request.json
     word = data.get("word")
 
-    if not word:
+    if not isinstance(word, str) or not word.strip():
         return jsonify({"error": "Укажите слово для удаления"}), 400
 
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("DELETE FROM words WHERE word_key = %s", (normalize_word(word),))
+        else:
+            cursor.execute("DELETE FROM words WHERE word_key = ?", (normalize_word(word),))
+        if cursor.rowcount == 0:
+            return None
+        notify_change(cursor, "deleted")
+        return True
+
     try:
-        with connect_db() as conn:
-            cursor = conn.cursor()
-            if DATABASE_URL:
-                cursor.execute("DELETE FROM words WHERE word = %s", (word,))
-            else:
-                cursor.execute("DELETE FROM words WHERE word = ?", (word,))
-            conn.commit()
-            if cursor.rowcount == 0:
-                return jsonify({"error": "Слово не найдено"}), 404
-            return jsonify({"success": True, "message": "Слово '{}' удалено!".format(word)})
+        if not run_write(write):
+            return jsonify({"error": "Слово не найдено"}), 404
+        publish_change("deleted")
+        return jsonify({"success": True, "message": "Слово '{}' удалено!".format(word)})
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
 @app.route("/reset_progress", methods=["POST"])
 def reset_progress():
+    # Kept for old clients; resets in chunks through the job queue instead of one long UPDATE
+    try:
+        job_id = submit_job("reset_progress")
+        return jsonify({"success": True, "job_id": job_id}), 202
+    except (sqlite3.Error, psycopg2.Error) as e:
+        return jsonify({"error": "Ошибка базы данных"}), 500
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    data = request.json or {}
+    kind = data.get("kind")
+
+    if kind not in JOB_KINDS:
+        return jsonify({"error": "Неизвестный тип задачи"}), 400
+
+    try:
+        job_id = submit_job(kind)
+        return jsonify({"success": True, "job_id": job_id}), 202
+    except (sqlite3.Error, psycopg2.Error) as e:
+        return jsonify({"error": "Ошибка базы данных"}), 500
+
+@app.route("/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
     try:
         with connect_db() as conn:
             cursor = conn.cursor()
-            cursor.execute("UPDATE words SET progress = 0")
-            conn.commit()
-            return jsonify({"success": True})
+            if DATABASE_URL:
+                cursor.execute("SELECT id, kind, status, done, total, error, created_at, updated_at FROM jobs WHERE id = %s", (job_id,))
+            else:
+                cursor.execute("SELECT id, kind, status, done, total, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,))
+            job = cursor.fetchone()
+            if not job:
+                return jsonify({"error": "Задача не найдена"}), 404
+            return jsonify({
+                "id": job[0],
+                "kind": job[1],
+                "status": job[2],
+                "done": job[3],
+                "total": job[4],
+                "error": job[5],
+                "created_at": str(job[6]),
+                "updated_at": str(job[7]),
+            })
+    except (sqlite3.Error, psycopg2.Error) as e:
+        return jsonify({"error": "Ошибка базы данных"}), 500
+
+@app.route("/jobs/<int:job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    def write(cursor):
+        if DATABASE_URL:
+            cursor.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = %s AND status IN ('queued', 'running')", (job_id,))
+        else:
+            cursor.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status IN ('queued', 'running')", (job_id,))
+        return cursor.rowcount
+
+    try:
+        if run_write(write) == 0:
+            return jsonify({"error": "Задача не найдена или уже завершена"}), 409
+        return jsonify({"success": True})
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
@@ -261,50 +1371,168 @@ def update_word():
     new_word = data.get("newWord")
     new_translation = data.get("newTranslation")
 
-    if not old_word or not new_word or not new_translation:
+    if (not all(isinstance(value, str) for value in (old_word, new_word, new_translation))
+            or not old_word.strip() or not new_word.strip() or not new_translation):
         return jsonify({"error": "Пожалуйста, укажите слово и перевод"}), 400
+    new_word = new_word.strip()
+
+    def write(cursor):
+        # First check if the old word exists
+        if DATABASE_URL:
+            cursor.execute("SELECT * FROM words WHERE word_key = %s", (normalize_word(old_word),))
+        else:
+            cursor.execute("SELECT * FROM words WHERE word_key = ?", (normalize_word(old_word),))
+        
+        if not cursor.fetchone():
+            return "not_found"
+
+        # Then check if the new word already exists (unless it's the same as old word)
+        if normalize_word(old_word) != normalize_word(new_word):
+            if DATABASE_URL:
+                cursor.execute("SELECT * FROM words WHERE word_key = %s", (normalize_word(new_word),))
+            else:
+                cursor.execute("SELECT * FROM words WHERE word_key = ?", (normalize_word(new_word),))
+            if cursor.fetchone():
+                return "exists"
+
+        # Finally, update the word
+        if DATABASE_URL:
+            cursor.execute("""
+                UPDATE words 
+                SET word = %s, word_key = %s, translation = %s
+                WHERE word_key = %s
+            """, (new_word, normalize_word(new_word), new_translation, normalize_word(old_word)))
+        else:
+            cursor.execute("""
+                UPDATE words 
+                SET word = ?, word_key = ?, translation = ?
+                WHERE word_key = ?
+            """, (new_word, normalize_word(new_word), new_translation, normalize_word(old_word)))
+            
+        notify_change(cursor, "updated")
+        return "updated"
+
+    try:
+        outcome = run_write(write)
+        if outcome == "not_found":
+            return jsonify({"error": "Слово не найдено"}), 404
+        if outcome == "exists":
+            return jsonify({"error": "Слово '{}' уже существует!".format(new_word)}), 409
+        publish_change("updated")
+        return jsonify({
+            "success": True, 
+            "message": "Слово '{}' обновлено на '{}'!".format(old_word, new_word)
+        })
+    except (sqlite3.Error, psycopg2.Error) as e:
+        return jsonify({"error": "Ошибка базы данных"}), 500
+
+@app.route("/events", methods=["GET"])
+def stream_events():
+    start_change_listener()
+    subscriber = changes.subscribe()
+    if subscriber is None:
+        return jsonify({"error": "Слишком много подключений"}), 503
+    counts_publisher.start()
+    try:
+        with connect_db() as conn:
+            initial = dict(read_counts(conn.cursor()), event="connected")
+    except (sqlite3.Error, psycopg2.Error) as e:
+        changes.unsubscribe(subscriber)
+        return jsonify({"error": "Ошибка базы данных"}), 500
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            yield format_event(initial)
+            deadline = time.monotonic() + SSE_MAX_DURATION
+            while time.monotonic() < deadline:
+                try:
+                    yield format_event(subscriber.get(timeout=SSE_HEARTBEAT))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            changes.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"X-Accel-Buffering": "no"})
+
+@app.route("/profiles", methods=["GET"])
+def list_profiles():
+    if not PROFILE_DIR or not PROFILE_TOKEN:
+        return jsonify({"error": "Профилирование выключено"}), 404
+    if not profile_authorized():
+        return jsonify({"error": "Доступ запрещён"}), 403
+    try:
+        names = sorted(f for f in os.listdir(PROFILE_DIR) if f.endswith(".json"))
+    except FileNotFoundError:
+        names = []
+
+    profiles = []
+    for name in reversed(names[-PROFILE_INDEX_SIZE:]):
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        meta.pop("sql", None)
+        profiles.append(meta)
+    return jsonify({"profiles": profiles})
+
+@app.route("/profiles/<name>", methods=["GET"])
+def get_profile(name):
+    if not PROFILE_DIR or not PROFILE_TOKEN:
+        return jsonify({"error": "Профилирование выключено"}), 404
+    if not profile_authorized():
+        return jsonify({"error": "Доступ запрещён"}), 403
+    return send_from_directory(os.path.abspath(PROFILE_DIR), name)
+
+@app.route("/analytics/daily", methods=["GET"])
+def get_daily_analytics():
+    days = request.args.get("days", 30, type=int)
+    days = max(1, min(days, 366))
+    since = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
 
     try:
         with connect_db() as conn:
             cursor = conn.cursor()
-            
-            # First check if the old word exists
             if DATABASE_URL:
-                cursor.execute("SELECT * FROM words WHERE word = %s", (old_word,))
+                cursor.execute("SELECT day, reviews, known, unknown FROM review_daily WHERE day > %s ORDER BY day DESC", (since,))
             else:
-                cursor.execute("SELECT * FROM words WHERE word = ?", (old_word,))
-            
-            if not cursor.fetchone():
-                return jsonify({"error": "Слово не найдено"}), 404
+                cursor.execute("SELECT day, reviews, known, unknown FROM review_daily WHERE day > ? ORDER BY day DESC", (since,))
+            return jsonify({"days": [
+                {"day": str(row[0]), "reviews": row[1], "known": row[2], "unknown": row[3]}
+                for row in cursor.fetchall()
+            ]})
+    except (sqlite3.Error, psycopg2.Error) as e:
+        return jsonify({"error": "Ошибка базы данных"}), 500
 
-            # Then check if the new word already exists (unless it's the same as old word)
-            if old_word != new_word:
-                if DATABASE_URL:
-                    cursor.execute("SELECT * FROM words WHERE word = %s", (new_word,))
-                else:
-                    cursor.execute("SELECT * FROM words WHERE word = ?", (new_word,))
-                if cursor.fetchone():
-                    return jsonify({"error": "Слово '{}' уже существует!".format(new_word)}), 409
+@app.route("/analytics/hardest", methods=["GET"])
+def get_hardest_words():
+    limit = request.args.get("limit", 10, type=int)
+    limit = max(1, min(limit, MAX_BATCH_SIZE))
+    days = request.args.get("days", 30, type=int)
+    days = max(1, min(days, 366))
+    since = (datetime.now(timezone.utc).date() - timedelta(days=days)).isoformat()
 
-            # Finally, update the word
+    try:
+        with connect_db() as conn:
+            cursor = conn.cursor()
             if DATABASE_URL:
                 cursor.execute("""
-                    UPDATE words 
-                    SET word = %s, translation = %s
-                    WHERE word = %s
-                """, (new_word, new_translation, old_word))
+                    SELECT word, SUM(reviews), SUM(unknown) FROM review_word_daily
+                    WHERE day > %s GROUP BY word
+                    ORDER BY SUM(unknown) DESC, SUM(reviews) DESC LIMIT %s
+                """, (since, limit))
             else:
                 cursor.execute("""
-                    UPDATE words 
-                    SET word = ?, translation = ?
-                    WHERE word = ?
-                """, (new_word, new_translation, old_word))
-                
-            conn.commit()
-            return jsonify({
-                "success": True, 
-                "message": "Слово '{}' обновлено на '{}'!".format(old_word, new_word)
-            })
+                    SELECT word, SUM(reviews), SUM(unknown) FROM review_word_daily
+                    WHERE day > ? GROUP BY word
+                    ORDER BY SUM(unknown) DESC, SUM(reviews) DESC LIMIT ?
+                """, (since, limit))
+            return jsonify({"words": [
+                {"word": row[0], "reviews": row[1], "unknown": row[2]}
+                for row in cursor.fetchall()
+            ]})
     except (sqlite3.Error, psycopg2.Error) as e:
         return jsonify({"error": "Ошибка базы данных"}), 500
 
@@ -313,5 +1541,35 @@ def add_header(response):
     response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     return response
 
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if not encoding:
+        return response
+
+    # Static files are served in passthrough mode, read them into memory to compress
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=min(COMPRESS_LEVEL, 11))
+    else:
+        compressed = gzip.compress(data, compresslevel=min(COMPRESS_LEVEL, 9), mtime=0)
+
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag("{}-{}".format(etag, encoding), weak)
+    return response
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Response size and CPU time per endpoint, and concurrent write throughput.
+
+Usage: python bench.py [iterations]
+       python bench.py writes [processes] [threads] [rounds]
+
+The writes benchmark runs several processes (like gunicorn workers) with several threads each.
+Every round adds a word, marks it known and deletes it again.
+Run it with WRITE_BATCH_SIZE=1 to compare against committing every write separately.
+
+Without DATABASE_URL both benchmarks run against a throwaway SQLite file in a temporary
+directory (or the SQLITE_PATH you pass), never the local flashcards.db.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Set before importing app; worker processes inherit it through the environment
+BENCH_DIR = None
+if not os.getenv("SQLITE_PATH"):
+    BENCH_DIR = tempfile.mkdtemp(prefix="flashcards-bench-")
+    os.environ["SQLITE_PATH"] = os.path.join(BENCH_DIR, "flashcards.db")
+
+from app import app, brotli, close_db, msgpack
+
+ENDPOINTS = [
+    "/",
+    "/static/script.js",
+    "/static/styles.css",
+    "/word",
+    "/words?limit=50",
+    "/stats",
+    "/total-words",
+]
+
+def measure(client, path, headers, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        rv = client.get(path, headers=headers)
+        rv.get_data()
+    cpu_ms = (time.process_time() - start) * 1000 / iterations
+    return len(rv.get_data()), cpu_ms
+
+def write_rounds(name, rounds):
+    statuses = {}
+    with app.test_client() as client:
+        for i in range(rounds):
+            word = "bench-{}-{}".format(name, i)
+            for path, payload in (
+                ("/add", {"word": word, "translation": word}),
+                ("/mark_known", {"word": word}),
+                ("/delete", {"word": word}),
+            ):
+                status = client.post(path, json=payload).status_code
+                statuses[status] = statuses.get(status, 0) + 1
+    return statuses
+
+def write_process(args):
+    process, threads, rounds = args
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(write_rounds, ["{}-{}".format(process, t) for t in range(threads)], [rounds] * threads))
+    statuses = {}
+    for result in results:
+        for status, count in result.items():
+            statuses[status] = statuses.get(status, 0) + count
+    return statuses
+
+def bench_writes(processes, threads, rounds):
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(write_process, [(p, threads, rounds) for p in range(processes)])
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for result in results:
+        for status, count in result.items():
+            statuses[status] = statuses.get(status, 0) + count
+    total = sum(statuses.values())
+    print("processes={} threads={} writes={}".format(processes, threads, total))
+    print("elapsed {:.2f}s, {:.0f} writes/s".format(elapsed, total / elapsed))
+    print("status codes: {}".format(dict(sorted(statuses.items()))))
+    print("errors (5xx): {}".format(sum(count for status, count in statuses.items() if status >= 500)))
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "writes":
+        args = [int(arg) for arg in sys.argv[2:5]]
+        bench_writes(*(args + [4, 8, 50][len(args):]))
+        return
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    variants = [("identity", {}), ("gzip", {"Accept-Encoding": "gzip"})]
+    if brotli:
+        variants.append(("br", {"Accept-Encoding": "br"}))
+
+    print("{:<20} {:<10} {:>10} {:>10}".format("endpoint", "encoding", "bytes", "cpu ms"))
+    with app.test_client() as client:
+        for path in ENDPOINTS:
+            for name, headers in variants:
+                size, cpu_ms = measure(client, path, headers, iterations)
+                print("{:<20} {:<10} {:>10} {:>10.3f}".format(path, name, size, cpu_ms))
+        if msgpack:
+            size, cpu_ms = measure(client, "/words?limit=50", {"Accept": "application/x-msgpack"}, iterations)
+            print("{:<20} {:<10} {:>10} {:>10.3f}".format("/words?limit=50", "msgpack", size, cpu_ms))
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        close_db()
+        if BENCH_DIR:
+            shutil.rmtree(BENCH_DIR, ignore_errors=True)
@@ -1,4 +1,5 @@
 document.addEventListener("DOMContentLoaded", function() {
+    connectStatsStream();
     loadNewWord();
     
     // Handle voice initialization for all platforms
@@ -25,6 +26,26 @@ document.addEventListener("DOMContentLoaded", function() {
     }
 });
 
+// Live counters pushed by the server; polling is only a fallback while the stream is down
+let statsStream = null;
+
+function connectStatsStream() {
+    if (!window.EventSource) return;
+
+    statsStream = new EventSource('/events');
+    statsStream.addEventListener('deck', function(event) {
+        const data = JSON.parse(event.data);
+        document.getElementById('totalCount').textContent = data.total_words;
+        document.getElementById('learnedCount').textContent = data.learned_words;
+    });
+}
+
+function refreshStats() {
+    if (statsStream && statsStream.readyState === EventSource.OPEN) return;
+    updateTotalWords();
+    loadStats();
+}
+
 // Global variables for voice management
 let currentWord = null;
 let isInitialized = false;
@@ -228,8 +249,7 @@ function loadNewWord() {
             const card = document.querySelector('.card');
             card.classList.remove('flipped');
             
-            updateTotalWords();
-            loadStats();
+            refreshStats();
         })
         .catch(error => {
             console.error('Error loading word:', error);
@@ -287,8 +307,6 @@ function deleteWord() {
     .then(data => {
         if (data.success) {
             loadNewWord();
-            updateTotalWords();
-            loadStats();
         }
     });
 }
@@ -353,7 +371,6 @@ function knowWord() {
     .then(data => {
         if (data.success) {
             loadNewWord();
-            loadStats();
         }
     });
 }
@@ -372,24 +389,42 @@ function dontKnowWord() {
     .then(data => {
         if (data.success) {
             loadNewWord();
-            loadStats();
         }
     });
 }
 
 function resetProgress() {
-    fetch('/reset_progress', {
+    // Runs as a background job on the server, so large decks don't block the request
+    fetch('/jobs', {
         method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ kind: 'reset_progress' })
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            loadNewWord();
-            loadStats();
+            waitForJob(data.job_id, loadNewWord);
         }
     });
 }
 
+function waitForJob(jobId, onDone) {
+    fetch(`/jobs/${jobId}`)
+        .then(response => response.json())
+        .then(job => {
+            if (job.status === 'queued' || job.status === 'running') {
+                setTimeout(() => waitForJob(jobId, onDone), 500);
+            } else if (job.status === 'done') {
+                onDone();
+            } else {
+                console.error('Задача завершилась со статусом:', job.status, job.error);
+            }
+        })
+        .catch(error => console.error('Ошибка проверки задачи:', error));
+}
+
 // Close modal when clicking outside
 window.onclick = function(event) {
     const modal = document.getElementById('editModal');
@@ -1,7 +1,16 @@
 import os
 import tempfile
 import pytest
-from app import app, init_db
+from app import app, init_db, close_db, sqlite_writer
+
+def remove_sqlite_files():
+    """Remove the local SQLite database together with its WAL files"""
+    close_db()
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove("flashcards.db" + suffix)
+        except OSError:
+            pass
 
 def get_test_database_url():
     """Get database URL for testing"""
@@ -51,19 +60,13 @@ def client():
         
         with app.test_client() as client:
             with app.app_context():
-                try:
-                    os.remove("flashcards.db")
-                except OSError:
-                    pass
+                remove_sqlite_files()
                 init_db()
                 yield client
         
         os.close(db_fd)
         os.unlink(db_path)
-        try:
-            os.remove("flashcards.db")
-        except OSError:
-            pass
+        remove_sqlite_files()
 
 # Test cases remain the same as they are database-agnostic
 def test_index(client):
@@ -195,9 +198,10 @@ def test_reset_progress(client):
     
     # Reset progress
     rv = client.post('/reset_progress')
-    assert rv.status_code == 200
+    assert rv.status_code == 202
     json_data = rv.get_json()
     assert json_data['success'] == True
+    assert wait_for_job(client, json_data['job_id'])['status'] == 'done'
     
     # Verify the word's progress was reset
     rv = client.get('/stats')
@@ -228,4 +232,374 @@ def test_database_connection(client):
         assert 'postgresql' in os.getenv('DATABASE_URL').lower()
     else:
         # Check if we're using SQLite locally
-        assert os.path.exists('flashcards.db')
\ No newline at end of file
+        assert os.path.exists('flashcards.db')
+
+def test_get_words_batch(client):
+    """Test getting a batch of random words for prefetching"""
+    rv = client.get('/words?limit=2')
+    assert rv.status_code == 200
+    json_data = rv.get_json()
+    assert len(json_data['words']) == 2
+    assert all('word' in w and 'translation' in w for w in json_data['words'])
+
+def test_gzip_compression(client):
+    """Test that large responses are gzip-compressed when the client accepts it"""
+    import gzip
+    rv = client.get('/static/script.js', headers={'Accept-Encoding': 'gzip'})
+    assert rv.status_code == 200
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in rv.headers['Vary']
+    assert b'loadNewWord' in gzip.decompress(rv.data)
+
+    # Small JSON payloads stay uncompressed
+    rv = client.get('/stats', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in rv.headers
+
+    # No compression without Accept-Encoding
+    rv = client.get('/static/script.js')
+    assert 'Content-Encoding' not in rv.headers
+    assert b'loadNewWord' in rv.data
+
+def test_review_analytics(client):
+    """Test that reviews are logged and rolled up into analytics"""
+    from app import rollup_reviews
+    client.post('/add', json={'word': 'hard', 'translation': 'трудный'})
+    client.post('/increase_progress', json={'word': 'hard'})
+    client.post('/increase_progress', json={'word': 'hard'})
+    client.post('/mark_known', json={'word': 'hello'})
+
+    rollup_reviews()
+
+    rv = client.get('/analytics/daily')
+    assert rv.status_code == 200
+    days = rv.get_json()['days']
+    assert len(days) == 1
+    assert days[0]['reviews'] == 3
+    assert days[0]['known'] == 1
+    assert days[0]['unknown'] == 2
+
+    rv = client.get('/analytics/hardest?limit=1')
+    assert rv.status_code == 200
+    assert rv.get_json()['words'] == [{'word': 'hard', 'reviews': 2, 'unknown': 2}]
+
+    # Spelling variants of a word are logged under its stored spelling
+    client.post('/increase_progress', json={'word': ' HARD '})
+    rollup_reviews()
+    rv = client.get('/analytics/hardest')
+    assert rv.get_json()['words'][0] == {'word': 'hard', 'reviews': 3, 'unknown': 3}
+
+    # Running the rollup again must not double count
+    rollup_reviews()
+    rv = client.get('/analytics/daily')
+    assert rv.get_json()['days'][0]['reviews'] == 4
+
+    rv = client.get('/analytics/hardest?days=1000000000')
+    assert rv.status_code == 200
+
+    # The daily window is a calendar window, like the hardest words, not the last N rows
+    if not os.getenv('DATABASE_URL'):
+        import sqlite3
+        from datetime import date, timedelta
+        old_day = (date.today() - timedelta(days=10)).isoformat()
+        with sqlite3.connect('flashcards.db') as conn:
+            conn.execute("INSERT INTO review_daily (day, reviews, known, unknown) VALUES (?, 1, 1, 0)", (old_day,))
+        assert len(client.get('/analytics/daily?days=5').get_json()['days']) == 1
+        assert len(client.get('/analytics/daily?days=30').get_json()['days']) == 2
+
+def test_normalized_word_matching(client):
+    """Test that case, whitespace and Unicode variants match the same word"""
+    import unicodedata
+    rv = client.post('/add', json={'word': 'Hello ', 'translation': 'привет'})
+    assert rv.status_code == 409
+
+    rv = client.post('/add', json={'word': 'ёж', 'translation': 'hedgehog'})
+    assert rv.status_code == 200
+    rv = client.post('/add', json={'word': unicodedata.normalize('NFD', 'ЁЖ'), 'translation': 'hedgehog'})
+    assert rv.status_code == 409
+
+    rv = client.post('/mark_known', json={'word': 'BOOK'})
+    assert rv.status_code == 200
+
+    # Changing only the case of a word is not a conflict with itself
+    rv = client.post('/update', json={'oldWord': 'world', 'newWord': 'World', 'newTranslation': 'мир'})
+    assert rv.status_code == 200
+
+    rv = client.post('/delete', json={'word': ' WORLD'})
+    assert rv.status_code == 200
+
+def test_non_string_words(client):
+    """Test that non-string words are rejected as bad requests"""
+    assert client.post('/add', json={'word': 123, 'translation': 'сто'}).status_code == 400
+    assert client.post('/mark_known', json={'word': 123}).status_code == 400
+    assert client.post('/increase_progress', json={'word': ['hello']}).status_code == 400
+    assert client.post('/delete', json={'word': {'w': 1}}).status_code == 400
+    rv = client.post('/update', json={'oldWord': 'hello', 'newWord': 5, 'newTranslation': 'пять'})
+    assert rv.status_code == 400
+
+def test_dedupe_words_command(client):
+    """Test that the dedupe command merges existing duplicates"""
+    import sqlite3
+    if os.getenv('DATABASE_URL'):
+        pytest.skip('SQLite only')
+    with sqlite3.connect('flashcards.db') as conn:
+        conn.execute("DROP INDEX words_word_key_idx")
+        conn.execute("INSERT INTO words (word, translation, progress) VALUES ('HELLO', 'привет', 3)")
+    init_db()
+
+    result = app.test_cli_runner().invoke(args=['dedupe-words'])
+    assert 'Удалено дубликатов: 1' in result.output
+
+    with sqlite3.connect('flashcards.db') as conn:
+        rows = conn.execute("SELECT word, progress FROM words WHERE word_key = 'hello'").fetchall()
+        indexes = conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    assert rows == [('hello', 3)]
+    assert ('words_word_key_idx',) in indexes
+
+def test_events_stream(client):
+    """Test that the event stream sends counters and pushes deck changes"""
+    import json
+    from app import changes
+    rv = client.get('/events', buffered=False)
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/event-stream'
+    stream = (chunk.decode('utf-8') for chunk in rv.response)
+    assert next(stream).startswith('retry:')
+    initial = next(stream)
+    assert initial.startswith('event: deck')
+    assert json.loads(initial.split('data: ', 1)[1])['total_words'] == 3
+
+    client.post('/add', json={'word': 'stream', 'translation': 'поток'})
+    message = json.loads(next(stream).split('data: ', 1)[1])
+    assert message == {'event': 'added', 'total_words': 4, 'learned_words': 0}
+
+    rv.close()
+    assert not changes._subscribers
+
+def test_request_profiling(client, tmp_path, monkeypatch):
+    """Test that a request sent with X-Profile leaves a collapsed stack profile"""
+    import app as app_module
+    rv = client.get('/profiles')
+    assert rv.status_code == 404
+
+    monkeypatch.setattr(app_module, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module, 'PROFILE_TOKEN', 'secret')
+    auth = {'X-Profile': 'secret'}
+
+    # A wrong token neither profiles the request nor opens the index
+    client.get('/stats', headers={'X-Profile': 'guess'})
+    assert client.get('/profiles', headers={'X-Profile': 'guess'}).status_code == 403
+
+    rv = client.post('/update', json={
+        'oldWord': 'hello',
+        'newWord': 'hi',
+        'newTranslation': 'привет'
+    }, headers=auth)
+    assert rv.status_code == 200
+
+    # Requests without the header are not profiled
+    client.get('/stats')
+
+    # A profile still being written by another worker is skipped
+    (tmp_path / '99999999T999999999999-GET-partial.json').write_text('{"name": ')
+
+    rv = client.get('/profiles', headers=auth)
+    profiles = rv.get_json()['profiles']
+    assert len(profiles) == 1
+    assert profiles[0]['path'] == '/update'
+    assert profiles[0]['duration_ms'] > 0
+
+    meta = client.get('/profiles/{}.json'.format(profiles[0]['name']), headers=auth).get_json()
+    statements = [item['statement'] for item in meta['sql']]
+    assert any(statement.startswith('UPDATE words') for statement in statements)
+
+    rv = client.get('/profiles/{}.collapsed'.format(profiles[0]['name']), headers=auth)
+    assert rv.status_code == 200
+    assert client.get('/profiles/{}.collapsed'.format(profiles[0]['name'])).status_code == 403
+    monkeypatch.undo()
+
+def test_profile_retention(client, tmp_path, monkeypatch):
+    """Test that only the newest profiles are kept and write errors do not fail requests"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(app_module, 'PROFILE_TOKEN', 'secret')
+    monkeypatch.setattr(app_module, 'PROFILE_RETENTION', 2)
+    auth = {'X-Profile': 'secret'}
+
+    for path in ('/stats', '/total-words', '/word'):
+        assert client.get(path, headers=auth).status_code == 200
+    names = sorted(f.name for f in tmp_path.iterdir())
+    assert len(names) == 4
+    assert not any('get_stats' in name for name in names)
+
+    # A profile directory that cannot be created is logged, the response is unaffected
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    monkeypatch.setattr(app_module, 'PROFILE_DIR', str(blocker / 'profiles'))
+    assert client.get('/stats', headers=auth).status_code == 200
+    monkeypatch.undo()
+
+def wait_for_job(client, job_id, timeout=5):
+    """Poll a background job until it leaves the queued/running states"""
+    import time
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get('/jobs/{}'.format(job_id)).get_json()
+        if job['status'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError('job {} did not finish'.format(job_id))
+
+def test_reset_progress_job(client, monkeypatch):
+    """Test resetting progress as a chunked background job"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'JOB_CHUNK_SIZE', 2)
+    client.post('/mark_known', json={'word': 'hello'})
+    client.post('/mark_known', json={'word': 'book'})
+
+    rv = client.post('/jobs', json={'kind': 'reset_progress'})
+    assert rv.status_code == 202
+    job_id = rv.get_json()['job_id']
+
+    job = wait_for_job(client, job_id)
+    assert job['status'] == 'done'
+    assert job['done'] == job['total'] == 3
+
+    rv = client.get('/stats')
+    assert rv.get_json()['learned_words'] == 0
+
+    # Finished jobs cannot be cancelled
+    rv = client.post('/jobs/{}/cancel'.format(job_id))
+    assert rv.status_code == 409
+
+def test_invalid_jobs(client):
+    """Test handling of invalid job requests"""
+    rv = client.post('/jobs', json={'kind': 'unknown'})
+    assert rv.status_code == 400
+
+    rv = client.get('/jobs/12345')
+    assert rv.status_code == 404
+
+def test_concurrent_writes(client):
+    """Test that concurrent writes are serialized by the writer without lock errors"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def add(i):
+        with app.test_client() as c:
+            return c.post('/add', json={'word': 'w{}'.format(i), 'translation': 'п{}'.format(i)}).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        statuses = list(executor.map(add, range(40)))
+    assert statuses == [200] * 40
+
+    rv = client.get('/total-words')
+    assert rv.get_json()['total_words'] == 43
+
+def test_writer_isolates_failed_operations(client):
+    """Test that a failing operation does not roll back others committed in the same batch"""
+    import sqlite3
+    if os.getenv('DATABASE_URL'):
+        pytest.skip('SQLite only')
+
+    def insert(cursor):
+        cursor.execute("INSERT INTO words (word, word_key, translation) VALUES ('ok', 'ok', 'ок')")
+
+    def fail(cursor):
+        cursor.execute("INSERT INTO words (word, word_key, translation) VALUES ('bad', 'bad', 'плохо')")
+        cursor.execute("INSERT INTO missing_table VALUES (1)")
+
+    ok = sqlite_writer.submit(insert)
+    failed = sqlite_writer.submit(fail)
+    ok.result()
+    with pytest.raises(sqlite3.OperationalError):
+        failed.result()
+
+    with sqlite3.connect('flashcards.db') as conn:
+        words = {row[0] for row in conn.execute("SELECT word FROM words")}
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert 'ok' in words
+    assert 'bad' not in words
+    assert journal_mode == 'wal'
+
+def test_events_stream_sees_other_processes(client, monkeypatch):
+    """Test that commits made outside this process reach the stream"""
+    import json
+    import sqlite3
+    import app as app_module
+    if os.getenv('DATABASE_URL'):
+        pytest.skip('SQLite only')
+    monkeypatch.setattr(app_module, 'COUNTS_POLL_INTERVAL', 0.05)
+    rv = client.get('/events', buffered=False)
+    stream = (chunk.decode('utf-8') for chunk in rv.response)
+    next(stream)
+    next(stream)
+
+    # Another gunicorn worker would commit through its own connection
+    with sqlite3.connect('flashcards.db') as conn:
+        conn.execute("INSERT INTO words (word, word_key, translation) VALUES ('other', 'other', 'другой')")
+
+    message = json.loads(next(stream).split('data: ', 1)[1])
+    while message['total_words'] != 4:
+        message = json.loads(next(stream).split('data: ', 1)[1])
+    assert message['event'] == 'changed'
+    rv.close()
+
+def test_events_stream_limit(client, monkeypatch):
+    """Test that streams above the per-process cap are refused"""
+    from app import changes
+    monkeypatch.setattr(changes, 'max_subscribers', 1)
+    first = client.get('/events', buffered=False)
+    assert first.status_code == 200
+
+    rv = client.get('/events')
+    assert rv.status_code == 503
+    first.close()
+
+def test_stale_jobs_fail(client, monkeypatch):
+    """Test that unfinished jobs of a dead process are marked as failed"""
+    import sqlite3
+    import app as app_module
+    if os.getenv('DATABASE_URL'):
+        pytest.skip('SQLite only')
+    with sqlite3.connect('flashcards.db') as conn:
+        cursor = conn.execute("""
+            INSERT INTO jobs (kind, status, owner, updated_at)
+            VALUES ('reset_progress', 'running', 'gone', datetime('now', '-1 hour'))
+        """)
+        job_id = cursor.lastrowid
+
+    app_module.job_heartbeat()
+
+    job = client.get('/jobs/{}'.format(job_id)).get_json()
+    assert job['status'] == 'failed'
+    assert job['error'] == app_module.JOB_INTERRUPTED_ERROR
+
+def test_words_batch_msgpack(client):
+    """Test that the batch endpoint negotiates MessagePack"""
+    msgpack = pytest.importorskip('msgpack')
+    rv = client.get('/words?limit=2', headers={'Accept': 'application/x-msgpack'})
+    assert rv.status_code == 200
+    assert rv.mimetype == 'application/x-msgpack'
+    assert 'Accept' in rv.headers['Vary']
+    assert len(msgpack.unpackb(rv.data)['words']) == 2
+
+    rv = client.get('/words?limit=2')
+    assert rv.mimetype == 'application/json'
+    assert 'Accept' in rv.headers['Vary']
+
+def test_brotli_compression(client):
+    """Test that brotli is preferred when the client accepts it"""
+    brotli = pytest.importorskip('brotli')
+    rv = client.get('/static/script.js', headers={'Accept-Encoding': 'gzip, br'})
+    assert rv.headers['Content-Encoding'] == 'br'
+    assert b'loadNewWord' in brotli.decompress(rv.data)
+
+def test_json_provider_matches_flask():
+    """Test that the JSON provider keeps Flask's sorting and default hook"""
+    import decimal
+    import uuid
+    with app.app_context():
+        dumped = app.json.dumps({'b': 1, 'a': 2})
+        assert dumped.index('"a"') < dumped.index('"b"')
+        assert app.json.loads(app.json.dumps({'d': decimal.Decimal('1.5')})) == {'d': '1.5'}
+        value = uuid.UUID(int=1)
+        assert app.json.loads(app.json.dumps([value])) == [str(value)]